@@ -9,7 +9,12 @@ from pychology.simple_search.a_star import NoPath
 
 from tacticsgrid.navgrid import scan_level
 from tacticsgrid.navgrid import nearest_node
+from tacticsgrid.navgrid import Navgrid
 from tacticsgrid.navgrid import DebugVisualization
+from tacticsgrid.path_cache import PathCache
+from tacticsgrid.landmarks import Landmarks
+from tacticsgrid.overlay import Overlay
+from tacticsgrid.smoothing import PathSmoother
 from tacticsgrid.optimizer import optimize_collisions
 
 
@@ -42,16 +47,24 @@ if __name__=='__main__':
     #DebugVisualization(level).update(navgrid, adjacency)
     
     dv = DebugVisualization(level)
+    grid = Navgrid(navgrid, adjacency)
+    overlay = Overlay(grid)
     click_path = [None, None]
     def neighbors(idx):
-        return [(i, c) for i, c in adjacency[idx].items()]
-    def euclidean_distance(from_idx, to_idx):
-        return (navgrid[from_idx][2] - navgrid[to_idx][2]).length()
+        return [(i, c) for i, c in overlay.neighbors(idx).items()]
+    landmarks = Landmarks(grid, num_landmarks=8)
+    def find_path(from_idx, to_idx):
+        return search(neighbors, from_idx, to_idx, landmarks.heuristic)
+    path_cache = PathCache(grid, find_path, overlay=overlay)
+    smoother = PathSmoother(level, navgrid, overlay=overlay)
     def update_path(from_idx, to_idx):
+        if not grid.reachable(from_idx, to_idx):
+            #print(f"{to_idx} is unreachable from {from_idx}")
+            return
         try:
-            path = search(neighbors, from_idx, to_idx, euclidean_distance)
+            path = path_cache.path(from_idx, to_idx)
             #print(f"Path from {from_idx} to {to_idx}")
-            dv.show_path(path, navgrid)
+            dv.show_path(smoother.smooth(path), navgrid)
         except NoPath:
             #print(f"No path from {from_idx} to {to_idx}")
             pass
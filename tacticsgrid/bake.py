@@ -0,0 +1,210 @@
+"""Headless batch baking of navgrids.
+
+    python -m tacticsgrid.bake -o baked/ levels/*.bam
+
+For each level, loads it without opening a window, runs
+optimize_collisions and scan_level, makes the tables for jump point search,
+and writes `<level>.navgrid` (see tacticsgrid.shared, load it with
+SharedNavgrid.load) and `<level>.json`, containing the bake parameters,
+scan statistics and the time spent in each phase. Scanning output is
+suppressed.
+
+Artifacts are placed in the output directory as the levels are in their
+common directory, so that levels of the same name in different directories
+don't collide; Levels that would still share artifacts, like town.bam and
+town.egg, are refused. Levels whose artifact is newer than the level and
+was baked with the same parameters are skipped. Levels are processed in
+parallel by a pool of processes; A summary of all of them is written to
+`bake_report.json`.
+"""
+import argparse
+import io
+import json
+import os
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from time import perf_counter
+
+from panda3d.core import Loader
+from panda3d.core import Filename
+from panda3d.core import NodePath
+
+from tacticsgrid.navgrid import scan_level
+from tacticsgrid.navgrid import Navgrid
+from tacticsgrid.jump_point import jump_point_tables
+from tacticsgrid.optimizer import optimize_collisions
+from tacticsgrid.shared import FORMAT_VERSION
+from tacticsgrid.shared import save_navgrid
+
+
+def common_dir(level_files):
+    return os.path.commonpath([
+        os.path.dirname(os.path.abspath(level_file))
+        for level_file in level_files
+    ])
+
+
+def artifact_paths(level_file, output_dir, root=None):
+    # root is the directory that level paths are taken relative to; By
+    # default the level's own.
+    if root is None:
+        root = os.path.dirname(os.path.abspath(level_file))
+    name = os.path.relpath(os.path.abspath(level_file), root)
+    name = os.path.splitext(name)[0]
+    return (
+        os.path.join(output_dir, name + '.navgrid'),
+        os.path.join(output_dir, name + '.json'),
+    )
+
+
+def is_up_to_date(level_file, output_dir, params, root=None):
+    navgrid_file, report_file = artifact_paths(level_file, output_dir, root)
+    if not (os.path.exists(navgrid_file) and os.path.exists(report_file)):
+        return False
+    if os.path.getmtime(navgrid_file) < os.path.getmtime(level_file):
+        return False
+    with open(report_file) as f:
+        try:
+            report = json.load(f)
+        except ValueError:
+            return False
+    return report.get('params') == params
+
+
+def load_level(level_file):
+    node = Loader.get_global_ptr().load_sync(
+        Filename.from_os_specific(level_file),
+    )
+    if node is None:
+        raise IOError(f"Could not load {level_file}")
+    return NodePath(node)
+
+
+def bake_level(level_file, output_dir, params, root=None):
+    timings = {}
+    start = perf_counter()
+    level = load_level(level_file)
+    level.set_collide_mask(1)
+    timings['load'] = perf_counter() - start
+
+    start = perf_counter()
+    optimize_collisions(level, convert_geometry=True)
+    timings['optimize'] = perf_counter() - start
+
+    stats = {}
+    # Progress of several processes at once is just noise.
+    with redirect_stdout(io.StringIO()):
+        navgrid, adjacency = scan_level(
+            level,
+            stepsize=params['stepsize'],
+            adaptive_levels=params['adaptive_levels'],
+            merge_tolerance=params['merge_tolerance'],
+            timings=timings,
+            stats=stats,
+        )
+
+    start = perf_counter()
+    jump_tables = jump_point_tables(Navgrid(navgrid, adjacency))
+    timings['jump_tables'] = perf_counter() - start
+
+    navgrid_file, report_file = artifact_paths(level_file, output_dir, root)
+    os.makedirs(os.path.dirname(navgrid_file), exist_ok=True)
+    start = perf_counter()
+    save_navgrid(navgrid, adjacency, navgrid_file, jump_tables)
+    timings['save'] = perf_counter() - start
+    level.remove_node()
+
+    report = dict(
+        level=level_file,
+        params=params,
+        nodes=len(navgrid),
+        edges=sum(len(edges) for edges in adjacency.values()),
+        scan=stats,
+        timings=timings,
+        total=sum(timings.values()),
+    )
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def bake_levels(level_files, output_dir, params, jobs=None, force=False):
+    os.makedirs(output_dir, exist_ok=True)
+    root = common_dir(level_files)
+    artifacts = {}  # navgrid file: level file
+    for level_file in level_files:
+        navgrid_file, _ = artifact_paths(level_file, output_dir, root)
+        if navgrid_file in artifacts:
+            raise ValueError(f"{artifacts[navgrid_file]} and {level_file} "
+                             f"would both be baked to {navgrid_file}")
+        artifacts[navgrid_file] = level_file
+
+    reports = {}
+    to_bake = []
+    for level_file in level_files:
+        if not force and is_up_to_date(level_file, output_dir, params, root):
+            print(f"{level_file}: up to date")
+            reports[level_file] = dict(level=level_file, skipped=True)
+        else:
+            to_bake.append(level_file)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(bake_level, level_file, output_dir, params, root):
+            level_file
+            for level_file in to_bake
+        }
+        for future in as_completed(futures):
+            level_file = futures[future]
+            try:
+                report = future.result()
+                print(f"{level_file}: {report['nodes']} nodes, "
+                      f"{report['total']:.2f}s")
+            except Exception as e:
+                report = dict(level=level_file, error=repr(e))
+                print(f"{level_file}: failed, {e!r}")
+            reports[level_file] = report
+
+    reports = [reports[level_file] for level_file in level_files]
+    with open(os.path.join(output_dir, 'bake_report.json'), 'w') as f:
+        json.dump(reports, f, indent=2)
+    return reports
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Bake navgrids for levels.")
+    parser.add_argument('levels', nargs='+', help="level files, e.g. .bam")
+    parser.add_argument('-o', '--output-dir', default='.')
+    parser.add_argument('-s', '--stepsize', type=float, default=0.5)
+    parser.add_argument('-a', '--adaptive-levels', type=int, default=0)
+    parser.add_argument('-m', '--merge-tolerance', type=float, default=0.01,
+                        help="vertical distance below which hits are merged")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="number of processes; Default: one per CPU")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help="bake levels even if they are up to date")
+    args = parser.parse_args(args)
+    params = dict(
+        format_version=FORMAT_VERSION,
+        stepsize=args.stepsize,
+        adaptive_levels=args.adaptive_levels,
+        merge_tolerance=args.merge_tolerance,
+    )
+    try:
+        reports = bake_levels(
+            args.levels,
+            args.output_dir,
+            params,
+            jobs=args.jobs,
+            force=args.force,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    if any('error' in report for report in reports):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
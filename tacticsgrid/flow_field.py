@@ -0,0 +1,84 @@
+from array import array
+from collections import OrderedDict
+from heapq import heappush
+from heapq import heappop
+
+
+NO_HOP = -1
+
+
+def dijkstra(grid, source, reverse=False):
+    # Returns (distances, next_hops) arrays over all nodes, where next_hops
+    # is the node before each node on its way from the source. If reverse,
+    # edges are followed backwards, so distances are those to the source,
+    # and next_hops is the next node on the way to it.
+    num_nodes = len(grid.navgrid)
+    edges = grid.predecessors if reverse else grid.neighbors
+    next_hops = array('l', [NO_HOP]) * num_nodes
+    distances = array('d', [float('inf')]) * num_nodes
+    distances[source] = 0.0
+
+    queue = [(0.0, source)]
+    while queue:
+        distance, node = heappop(queue)
+        if distance > distances[node]:
+            continue  # Stale entry
+        for other, cost in edges(node).items():
+            other_distance = distance + cost
+            if other_distance < distances[other]:
+                distances[other] = other_distance
+                next_hops[other] = node
+                heappush(queue, (other_distance, other))
+    return distances, next_hops
+
+
+class FlowField:
+    """Distance to the goal and the next node on the way there for every
+    node of a Navgrid, so that any number of agents can walk to the goal by
+    looking up one entry per step.
+
+    Since climbing and falling are asymmetric, this runs Dijkstra from the
+    goal backwards along the edges leading into each node.
+    """
+    def __init__(self, grid, goal):
+        self.goal = goal
+        self.distances, self.next_hops = dijkstra(grid, goal, reverse=True)
+
+    def next_hop(self, from_idx):
+        # NO_HOP at the goal, and where the goal can't be reached.
+        return self.next_hops[from_idx]
+
+    def distance(self, from_idx):
+        return self.distances[from_idx]
+
+    def path(self, from_idx):
+        # (cost, path), like a search would return it, or None.
+        if self.distances[from_idx] == float('inf'):
+            return None
+        path = [from_idx]
+        while path[-1] != self.goal:
+            path.append(self.next_hops[path[-1]])
+        return self.distances[from_idx], path
+
+
+class FlowFieldCache:
+    """Keeps the flow fields of the capacity most recently used goals. After
+    the navgrid's edges change, the fields have to be cleared.
+    """
+    def __init__(self, grid, capacity=16):
+        self.grid = grid
+        self.capacity = capacity
+        self.fields = OrderedDict()  # goal: FlowField
+
+    def field(self, goal):
+        if goal in self.fields:
+            self.fields.move_to_end(goal)
+            return self.fields[goal]
+        field = FlowField(self.grid, goal)
+        self.fields[goal] = field
+        while len(self.fields) > self.capacity:
+            self.fields.popitem(last=False)
+        return field
+
+    def clear(self):
+        self.fields.clear()
@@ -0,0 +1,261 @@
+from array import array
+from heapq import heappush
+from heapq import heappop
+
+from tacticsgrid.navgrid import neighbor_coords
+from tacticsgrid.navgrid import check_complete
+
+
+class NoPath(Exception):
+    pass
+
+
+def planar_distance(navgrid):
+    # Admissible for the costs of TerrainTraverser, which are never less
+    # than the distance in the XY plane.
+    def heuristic(from_idx, to_idx):
+        from_pos = navgrid[from_idx][2]
+        to_pos = navgrid[to_idx][2]
+        dx = to_pos.x - from_pos.x
+        dy = to_pos.y - from_pos.y
+        return (dx * dx + dy * dy) ** 0.5
+    return heuristic
+
+
+# The eight directions of a step, and the bit of each in the masks.
+directions = [d for d in neighbor_coords if d != (0, 0)]
+direction_bits = {direction: 1 << i for i, direction in enumerate(directions)}
+direction_index = {direction: i for i, direction in enumerate(directions)}
+# For each direction, the indices of its straight components if diagonal,
+# and the mask of the successors that moving on in it reaches naturally.
+straight_indices = [
+    [direction_index[(dx, 0)], direction_index[(0, dy)]] if dx and dy else []
+    for dx, dy in directions
+]
+natural_masks = [
+    direction_bits[direction]
+    | sum(1 << straight for straight in straight_indices[d])
+    for d, direction in enumerate(directions)
+]
+
+
+def _unpruned(grid, from_idx, idx):
+    # Mask of the successors of idx that can't be pruned when coming from
+    # from_idx, both of them uniform.
+    navgrid = grid.navgrid
+    from_x, from_y, _ = navgrid[from_idx]
+    x, y, _ = navgrid[idx]
+    diagonal = from_x != x and from_y != y
+    from_edges = grid.neighbors(from_idx)
+    mid_edges = [
+        (mid_idx, mid_cost, grid.neighbors(mid_idx),
+         navgrid[mid_idx][0] != from_x and navgrid[mid_idx][1] != from_y)
+        for mid_idx, mid_cost in from_edges.items()
+        if mid_idx != idx
+    ]
+    to_cost = from_edges[idx]
+    mask = 0
+    for succ, succ_cost in grid.neighbors(idx).items():
+        if succ == from_idx:
+            continue
+        via_idx = to_cost + succ_cost
+        # Cheapest way from from_idx to succ in up to two steps without
+        # passing through idx, and the same for only those ways that take a
+        # diagonal step first.
+        other = from_edges.get(succ, float('inf'))
+        canonical = other
+        for mid_idx, mid_cost, edges, mid_diagonal in mid_edges:
+            if succ not in edges:
+                continue
+            cost = mid_cost + edges[succ]
+            other = min(other, cost)
+            if mid_diagonal:
+                canonical = min(canonical, cost)
+        # Ties are only broken in favor of diagonal steps first, so that not
+        # every optimal path gets pruned.
+        if diagonal:
+            prunable = other < via_idx - 1e-9
+        else:
+            prunable = other < via_idx - 1e-9 or canonical <= via_idx + 1e-9
+        if not prunable:
+            succ_x, succ_y, _ = navgrid[succ]
+            mask |= direction_bits[(succ_x - x, succ_y - y)]
+    return mask
+
+
+def jump_point_tables(grid, tolerance=1e-4):
+    """Returns (uniform, kept, steps, step_costs), the tables that
+    JumpPointSearch prunes and jumps with, which only depend on the navgrid,
+    so that they can be baked with it.
+
+    uniform[idx] is 1 for uniform nodes. For a uniform node idx, steps[idx *
+    8 + d] is the node that a step in directions[d] leads to, or -1, and
+    step_costs[idx * 8 + d] its cost. For a uniform node idx reached from a
+    uniform neighbor in directions[d], kept[idx * 8 + d] is the mask of the
+    directions (see direction_bits) of the successors that can't be pruned.
+    """
+    check_complete(grid)
+    navgrid = grid.navgrid
+    num_nodes = len(navgrid)
+    column_sizes = {}
+    for x, y, _ in navgrid:
+        column_sizes[(x, y)] = column_sizes.get((x, y), 0) + 1
+
+    uniform = bytearray(num_nodes)
+    steps = array('l', [-1]) * (num_nodes * 8)
+    step_costs = array('d', [0.0]) * (num_nodes * 8)
+    for idx, (x, y, pos) in enumerate(navgrid):
+        if column_sizes[(x, y)] != 1:
+            continue
+        node_steps = {}
+        for to_idx, cost in grid.neighbors(idx).items():
+            to_x, to_y, to_pos = navgrid[to_idx]
+            d = direction_index.get((to_x - x, to_y - y))
+            if d is None or d in node_steps:
+                break
+            if abs(to_pos.z - pos.z) > tolerance:
+                break
+            node_steps[d] = (to_idx, cost)
+        else:
+            uniform[idx] = 1
+            for d, (to_idx, cost) in node_steps.items():
+                steps[idx * 8 + d] = to_idx
+                step_costs[idx * 8 + d] = cost
+
+    kept = bytearray(num_nodes * 8)
+    for idx in range(num_nodes):
+        if not uniform[idx]:
+            continue
+        x, y, _ = navgrid[idx]
+        for from_idx in grid.predecessors(idx):
+            if uniform[from_idx]:
+                from_x, from_y, _ = navgrid[from_idx]
+                d = direction_index[(x - from_x, y - from_y)]
+                kept[idx * 8 + d] = _unpruned(grid, from_idx, idx)
+    return uniform, kept, steps, step_costs
+
+
+class JumpPointSearch:
+    """A* with jump point search pruning on the flat parts of a navgrid.
+
+    A node is uniform if it is the only one in its column, and all its edges
+    lead to neighboring columns at the same height. Moving in a straight
+    line over uniform nodes, the search skips ("jumps" over) every node
+    whose other successors can be reached at least as cheaply without
+    passing through it. Since which successors these are depends only on the
+    node and its predecessor, they are looked up in tables made by
+    jump_point_tables, as are the steps between uniform nodes. Unless they
+    are passed as tables, those baked with a SharedNavgrid are used, or they
+    are made here, which takes a while on big navgrids. Everywhere else,
+    nodes are expanded as by ordinary A*.
+    """
+    def __init__(self, grid, tables=None, tolerance=1e-4):
+        self.grid = grid
+        if tables is None:
+            tables = getattr(grid, 'jump_tables', None)
+        if tables is None:
+            tables = jump_point_tables(grid, tolerance)
+        self.uniform, self.kept, self.steps, self.step_costs = tables
+
+    def _jump(self, from_idx, idx, d, cost, goal):
+        # Follows directions[d] from from_idx, where idx is the first step,
+        # costing cost, up to the next node that needs to be expanded.
+        # Returns (node, cost, node before it), or None at a dead end.
+        uniform = self.uniform
+        kept_table = self.kept
+        steps = self.steps
+        step_costs = self.step_costs
+        natural = natural_masks[d]
+        straights = straight_indices[d]
+        while True:
+            if idx == goal or not (uniform[idx] and uniform[from_idx]):
+                return idx, cost, from_idx
+            base = idx * 8
+            kept = kept_table[base + d]
+            if kept & ~natural:
+                return idx, cost, from_idx  # Forced neighbor
+            for straight in straights:
+                if kept >> straight & 1 and self._jump(
+                        idx, steps[base + straight], straight,
+                        step_costs[base + straight], goal):
+                    return idx, cost, from_idx
+            if not kept >> d & 1:
+                return None
+            cost += step_costs[base + d]
+            from_idx, idx = idx, steps[base + d]
+
+    def _successors(self, idx, ray, goal):
+        # ray is (node before idx, direction index) if idx was reached by a
+        # step in one of the directions. Returns
+        # [(jump point, cost, its ray, first step, direction index), ...]
+        kept = None
+        if ray is not None:
+            before, d = ray
+            if self.uniform[idx] and self.uniform[before]:
+                kept = self.kept[idx * 8 + d]
+        if kept is not None:
+            base = idx * 8
+            candidates = [
+                (self.steps[base + d], self.step_costs[base + d], d)
+                for d in range(8) if kept >> d & 1
+            ]
+        else:
+            navgrid = self.grid.navgrid
+            x, y, _ = navgrid[idx]
+            candidates = []
+            for succ, cost in self.grid.neighbors(idx).items():
+                succ_x, succ_y, _ = navgrid[succ]
+                d = direction_index.get((succ_x - x, succ_y - y))
+                candidates.append((succ, cost, d))
+        successors = []
+        for succ, cost, d in candidates:
+            if d is None:
+                successors.append((succ, cost, None, succ, None))
+                continue
+            jump = self._jump(idx, succ, d, cost, goal)
+            if jump is not None:
+                jump_point, jump_cost, before = jump
+                successors.append(
+                    (jump_point, jump_cost, (before, d), succ, d),
+                )
+        return successors
+
+    def search(self, start, goal, heuristic=None):
+        # Returns (cost, path), with every node along the path.
+        if heuristic is None:
+            heuristic = planar_distance(self.grid.navgrid)
+        costs = {start: 0.0}
+        # idx: (jump point before, first step, direction index)
+        came_from = {start: None}
+        rays = {start: None}
+        queue = [(heuristic(start, goal), 0.0, start)]
+        while queue:
+            _, cost, idx = heappop(queue)
+            if cost > costs[idx]:
+                continue  # Stale entry
+            if idx == goal:
+                return cost, self._path(came_from, goal)
+            for succ, succ_cost, ray, first, d in self._successors(
+                    idx, rays[idx], goal):
+                succ_cost += cost
+                if succ_cost < costs.get(succ, float('inf')):
+                    costs[succ] = succ_cost
+                    came_from[succ] = (idx, first, d)
+                    rays[succ] = ray
+                    heappush(
+                        queue,
+                        (succ_cost + heuristic(succ, goal), succ_cost, succ),
+                    )
+        raise NoPath
+
+    def _path(self, came_from, goal):
+        # Fills in the nodes that were jumped over.
+        path = [goal]
+        while came_from[path[-1]] is not None:
+            to_idx = path.pop()
+            from_idx, idx, d = came_from[to_idx]
+            segment = [from_idx, idx]
+            while segment[-1] != to_idx:
+                segment.append(self.steps[segment[-1] * 8 + d])
+            path += reversed(segment)
+        return path[::-1]
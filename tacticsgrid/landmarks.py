@@ -0,0 +1,102 @@
+from tacticsgrid.flow_field import dijkstra
+from tacticsgrid.navgrid import strongly_connected_components
+from tacticsgrid.navgrid import check_complete
+
+
+def _components(grid):
+    # Component of each node, as Navgrid and SharedNavgrid keep them, or
+    # determined here if a Navgrid's are out of date.
+    if getattr(grid, 'reach', None) is not None:
+        return grid.component
+    num_nodes = len(grid.navgrid)
+    adjacency = {idx: grid.neighbors(idx) for idx in range(num_nodes)}
+    component, _ = strongly_connected_components(num_nodes, adjacency)
+    return component
+
+
+class Landmarks:
+    """A* heuristic using the triangle inequality on the distances from and
+    to a number of landmark nodes (ALT). It is much tighter than the
+    euclidean distance when obstacles force detours or climbing dominates
+    the cost of a path.
+
+    Each strongly connected component with at least min_component_share of
+    the nodes gets a landmark first, the largest ones first. The others are
+    chosen by farthest point selection among the nodes that the landmarks
+    so far connect to, so that small unconnected parts of the level don't
+    use them up. Each one costs two Dijkstra searches at construction (one
+    more to find those of the components), and two arrays of floats with an
+    entry per node, so num_landmarks trades memory and setup time for fewer
+    expanded nodes.
+    """
+    def __init__(self, grid, num_landmarks=8, min_component_share=0.01):
+        check_complete(grid)
+        self.grid = grid
+        self.landmarks = []
+        self.from_landmark = []  # [distances from landmark, ...]
+        self.to_landmark = []  # [distances to landmark, ...]
+        num_nodes = len(grid.navgrid)
+        if not num_nodes:
+            return
+
+        # Distance of each node to the nearest landmark, in either direction.
+        nearest = [float('inf')] * num_nodes
+
+        # One landmark in each large component, at the node farthest away
+        # from the first one in it.
+        component = _components(grid)
+        members = {}  # component: [idx, ...]
+        for idx, comp in enumerate(component):
+            members.setdefault(comp, []).append(idx)
+        large = sorted(
+            (nodes for nodes in members.values()
+             if len(nodes) >= max(min_component_share * num_nodes, 2)),
+            key=len,
+            reverse=True,
+        )
+        for nodes in large[:num_landmarks]:
+            distances, _ = dijkstra(grid, nodes[0])
+            self._add(max(nodes, key=distances.__getitem__), nearest)
+
+        # Nodes that no landmark connects to are left out, or they would be
+        # the farthest of all.
+        while len(self.landmarks) < num_landmarks:
+            connected = [
+                idx for idx, distance in enumerate(nearest)
+                if distance != float('inf')
+            ]
+            if not connected:
+                connected = range(num_nodes)
+            candidate = max(connected, key=nearest.__getitem__)
+            if candidate in self.landmarks:
+                break
+            self._add(candidate, nearest)
+
+    def _add(self, landmark, nearest):
+        from_distances, _ = dijkstra(self.grid, landmark)
+        to_distances, _ = dijkstra(self.grid, landmark, reverse=True)
+        self.landmarks.append(landmark)
+        self.from_landmark.append(from_distances)
+        self.to_landmark.append(to_distances)
+        for idx in range(len(nearest)):
+            nearest[idx] = min(
+                nearest[idx],
+                from_distances[idx],
+                to_distances[idx],
+            )
+
+    def heuristic(self, from_idx, to_idx):
+        # d(L, to) <= d(L, from) + d(from, to), and
+        # d(from, L) <= d(from, to) + d(to, L).
+        # Infinite distances mean that a landmark doesn't tell us anything
+        # (the difference is NaN or -inf), or that there is no path (inf).
+        best = 0.0
+        for from_landmark, to_landmark in zip(self.from_landmark,
+                                              self.to_landmark):
+            bound = from_landmark[to_idx] - from_landmark[from_idx]
+            if bound > best:
+                best = bound
+            bound = to_landmark[from_idx] - to_landmark[to_idx]
+            if bound > best:
+                best = bound
+        return best
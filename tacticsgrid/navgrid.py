@@ -1,5 +1,9 @@
+import struct
+from array import array
 from collections import defaultdict
 from itertools import product
+from math import floor
+from time import perf_counter
 
 from panda3d.core import Vec2
 from panda3d.core import Vec3
@@ -13,26 +17,114 @@ from panda3d.core import CollisionSegment
 from panda3d.core import LineSegs
 
 
-def find_footfalls(level, origin, x_interval, y_interval):
-    # Just your basic collision traverser setup.
-    traverser = CollisionTraverser('first point finder')
-    ray = CollisionRay(0, 0, 0, 0, 0, -1)
-    ray_node = CollisionNode('ray')
-    ray_node.add_solid(ray)
-    ray_np = NodePath(ray_node)
-    ray_np.reparent_to(level)
-    queue = CollisionHandlerQueue()
-    traverser.add_collider(ray_np, queue)
-
-    def scan_coord(origin, x, y):
-        ray_np.set_pos(origin)
-        traverser.traverse(level)
-        # We collect points in a set to weed out duplicates.
-        navpoints = set(
-            (x, y, entry.get_surface_point(level))
-            for entry in queue.entries
+class FootfallScanner:
+    def __init__(self, level, merge_tolerance=0.01, walk_clearance=0.05):
+        self.level = level
+        # Hits in a column closer than this vertically are merged.
+        self.merge_tolerance = merge_tolerance
+        # How far above and below a surface is_level_walk looks for geometry.
+        self.walk_clearance = walk_clearance
+
+        # Just your basic collision traverser setup.
+        self.traverser = CollisionTraverser('first point finder')
+        ray = CollisionRay(0, 0, 0, 0, 0, -1)
+        ray_node = CollisionNode('ray')
+        ray_node.add_solid(ray)
+        self.ray_np = NodePath(ray_node)
+        self.ray_np.reparent_to(self.level)
+        self.queue = CollisionHandlerQueue()
+        self.traverser.add_collider(self.ray_np, self.queue)
+        self.rays_cast = 0
+        self.hits = 0
+        self.merged_hits = 0
+
+        # Segments just above and just below the line between two surface
+        # points, each in both directions, since polygons are only hit from
+        # their front side.
+        self.walk_traverser = CollisionTraverser('level walk tester')
+        self.walk_queue = CollisionHandlerQueue()
+        self.walk_segments = []
+        for i in range(4):
+            segment = CollisionSegment(0, 0, 0, 1, 0, 0)
+            segment_node = CollisionNode(f'walk segment {i}')
+            segment_node.add_solid(segment)
+            segment_np = NodePath(segment_node)
+            segment_np.reparent_to(self.level)
+            self.walk_traverser.add_collider(segment_np, self.walk_queue)
+            self.walk_segments.append((segment, segment_np))
+        self.walk_tests = 0
+
+    def scan(self, origin):
+        # Returns [(surface_point, surface_normal), ...], topmost first.
+        self.ray_np.set_pos(origin)
+        self.traverser.traverse(self.level)
+        self.rays_cast += 1
+        hits = sorted(
+            (
+                (entry.get_surface_point(self.level),
+                 entry.get_surface_normal(self.level))
+                for entry in self.queue.entries
+            ),
+            key=lambda hit: -hit[0].z,
         )
-        return list(navpoints)
+        self.hits += len(hits)
+        # Double-sided faces and polygon seams produce (nearly) identical
+        # hits, which we weed out by hashing heights into buckets the size of
+        # the tolerance, so that only neighboring buckets need checking.
+        tolerance = self.merge_tolerance
+        buckets = {}  # bucket: point
+        footfalls = []
+        for point, normal in hits:
+            if tolerance > 0:
+                bucket = floor(point.z / tolerance)
+            else:
+                bucket = point.z
+            nearby = (buckets.get(b) for b in (bucket - 1, bucket, bucket + 1))
+            if any(p is not None and abs(p.z - point.z) <= tolerance
+                   for p in nearby):
+                self.merged_hits += 1
+                continue
+            buckets[bucket] = point
+            footfalls.append((point, normal))
+        return footfalls
+
+    def is_level_walk(self, from_point, to_point):
+        # Whether the straight line between two points on the same surface
+        # stays on it, i.e. there is no geometry within walk_clearance above
+        # or below it; Steps, curbs, walls and the sides of pits are.
+        clearance = Vec3(0, 0, self.walk_clearance)
+        lines = [
+            (from_point + clearance, to_point + clearance),
+            (to_point + clearance, from_point + clearance),
+            (from_point - clearance, to_point - clearance),
+            (to_point - clearance, from_point - clearance),
+        ]
+        for (segment, _), (point_a, point_b) in zip(self.walk_segments, lines):
+            segment.set_point_a(point_a)
+            segment.set_point_b(point_b)
+        self.walk_traverser.traverse(self.level)
+        self.walk_tests += 1
+        return self.walk_queue.get_num_entries() == 0
+
+    def remove(self):
+        self.ray_np.remove_node()
+        for _, segment_np in self.walk_segments:
+            segment_np.remove_node()
+
+
+def _scan_stats(scanner, stats):
+    if stats is not None:
+        stats['rays'] = scanner.rays_cast
+        stats['hits'] = scanner.hits
+        stats['merged_hits'] = scanner.merged_hits
+        stats['walk_tests'] = scanner.walk_tests
+
+
+def find_footfalls(level, origin, x_interval, y_interval,
+                   merge_tolerance=0.01, stats=None):
+    # If stats is a dict, the numbers of rays cast, hits, and hits merged
+    # into others are stored in it.
+    scanner = FootfallScanner(level, merge_tolerance)
 
     navgrid = []
     x_idx = 0
@@ -46,17 +138,154 @@ def find_footfalls(level, origin, x_interval, y_interval):
                 origin.y + y,
                 origin.z,
             )
-            new_places = scan_coord(coord, x_idx, y_idx)
+            new_places = [
+                (x_idx, y_idx, point)
+                for point, _ in scanner.scan(coord)
+            ]
             navgrid += new_places
             y_idx += 1
             y += y_interval[2]
         x_idx += 1
         x += x_interval[2]
 
-    ray_np.remove_node()
+    scanner.remove()
+    _scan_stats(scanner, stats)
     return navgrid
 
 
+def _is_uniform_cell(corners, center, tolerance):
+    # corners are the hits at (i, j), (i+s, j), (i, j+s), (i+s, j+s), center
+    # the hits at (i+s/2, j+s/2). The samples are uniform if every one hits
+    # the same number of layers, and each layer is a single plane across the
+    # cell; Otherwise there is a height change or surface edge inside it.
+    # Edges that no sample falls on are found by is_level_walk.
+    num_layers = len(center)
+    if any(len(hits) != num_layers for hits in corners):
+        return False
+    for layer in range(num_layers):
+        (p00, n00), (p10, _), (p01, _), (p11, _) = (
+            hits[layer] for hits in corners
+        )
+        if abs((p00.z + p11.z) - (p10.z + p01.z)) > tolerance:
+            return False
+        p_center, n_center = center[layer]
+        mean_z = (p00.z + p10.z + p01.z + p11.z) / 4
+        if abs(p_center.z - mean_z) > tolerance:
+            return False
+        for _, normal in [hits[layer] for hits in corners] + [center[layer]]:
+            if (normal - n00).length() > tolerance:
+                return False
+    return True
+
+
+def find_footfalls_adaptive(level, origin, x_interval, y_interval,
+                            max_level=3, tolerance=0.01, merge_tolerance=0.01,
+                            stats=None):
+    # Like find_footfalls, but scans cells of 2**max_level steps first, and
+    # only subdivides cells that aren't uniform. Node indices are still on
+    # the finest lattice. Since nodes are now sparse, the returned
+    # neighborhood {(x, y): {(nx, ny), ...}} replaces the 8 neighborhood.
+    # stats also gets the number of lattice points, to compare rays to.
+    scanner = FootfallScanner(level, merge_tolerance)
+    x_start, x_end, step = x_interval
+    y_start, y_end, _ = y_interval
+    x_steps = int((x_end - x_start) / step)
+    y_steps = int((y_end - y_start) / step)
+
+    samples = {}  # (x, y): [(point, normal), ...]
+    def sample(x, y):
+        if (x, y) not in samples:
+            coord = Vec3(
+                origin.x + x_start + x * step,
+                origin.y + y_start + y * step,
+                origin.z,
+            )
+            samples[(x, y)] = scanner.scan(coord)
+        return samples[(x, y)]
+
+    # A leaf only gets edges along its sides and diagonals, so those are
+    # the lines that have to be free of surface edges. Sides are shared
+    # with the neighboring cell, so results are kept.
+    walks = {}  # (a, b): bool
+    def is_level_walk(a, b):
+        if (a, b) not in walks:
+            walks[(a, b)] = all(
+                scanner.is_level_walk(point_a, point_b)
+                for (point_a, _), (point_b, _) in zip(samples[a], samples[b])
+            )
+        return walks[(a, b)]
+
+    # Build the quadtree
+    root_size = 2 ** max_level
+    cells = [
+        (x, y, root_size)
+        for x in range(0, max(x_steps, 1), root_size)
+        for y in range(0, max(y_steps, 1), root_size)
+    ]
+    leaves = []
+    while cells:
+        x, y, size = cells.pop()
+        corners = [
+            sample(x, y),
+            sample(x + size, y),
+            sample(x, y + size),
+            sample(x + size, y + size),
+        ]
+        if size == 1:
+            leaves.append((x, y, size))
+            continue
+        half = size // 2
+        center = sample(x + half, y + half)
+        c00, c10, c01, c11 = (
+            (x, y), (x + size, y), (x, y + size), (x + size, y + size),
+        )
+        if (_is_uniform_cell(corners, center, tolerance)
+                and all(is_level_walk(a, b) for a, b in [
+                    (c00, c10), (c01, c11), (c00, c01), (c10, c11),
+                    (c00, c11), (c10, c01),
+                ])):
+            leaves.append((x, y, size))
+        else:
+            cells += [
+                (x, y, half),
+                (x + half, y, half),
+                (x, y + half, half),
+                (x + half, y + half, half),
+            ]
+    scanner.remove()
+
+    # Connect consecutive samples along each side of a leaf, so that a big
+    # cell next to several small ones gets connected to each of them, and
+    # the corners across the diagonals. For leaves of a single step, that is
+    # the 8 neighborhood.
+    neighborhood = defaultdict(set)
+    for x, y, size in leaves:
+        sides = [
+            [(x + d, y) for d in range(size + 1)],
+            [(x + d, y + size) for d in range(size + 1)],
+            [(x, y + d) for d in range(size + 1)],
+            [(x + size, y + d) for d in range(size + 1)],
+        ]
+        pairs = [((x, y), (x + size, y + size)),
+                 ((x + size, y), (x, y + size))]
+        for side in sides:
+            side = [c for c in side if c in samples]
+            pairs += zip(side, side[1:])
+        for a, b in pairs:
+            neighborhood[a].add(b)
+            neighborhood[b].add(a)
+
+    navgrid = [
+        (x, y, point)
+        for (x, y) in sorted(neighborhood)
+        for point, _ in samples[(x, y)]
+    ]
+    _scan_stats(scanner, stats)
+    if stats is not None:
+        stats['lattice_points'] = (x_steps + 1) * (y_steps + 1)
+    return navgrid, dict(neighborhood)
+
+
 def filter_for_standability(level, navgrid):
     traverser = CollisionTraverser('standability tester')
     sphere = CollisionSphere(0, 0, 1, 0.8)
@@ -94,11 +323,27 @@ class TerrainTraverser:
         self.queue = CollisionHandlerQueue()
         self.traverser.add_collider(self.segment_np, self.queue)
 
-    def is_traversible(self, from_coord, to_coord):
+        # For testing many segments at once; Created as needed.
+        self.batch_traverser = CollisionTraverser('batch walking collider')
+        self.batch_queue = CollisionHandlerQueue()
+        self.batch_segments = []  # [(segment, segment_np), ...]
+
+    def cost(self, from_coord, to_coord):
+        # The cost of walking between the coords, disregarding obstacles.
         dz = to_coord.z - from_coord.z
         dxy = (Vec2(to_coord.x, to_coord.y) - Vec2(from_coord.x, from_coord.y)).length()
         # Blot out the 45° cone above the from coord
-        if dz > dxy:  
+        if dz > dxy:
+            return False
+
+        cost = dxy
+        if dz > 0:  # Falling is considered free, climbing costs extra.
+            cost = cost * (1 + dz / dxy)  # LERP factor between 1 and 2.
+        return cost
+
+    def is_traversible(self, from_coord, to_coord):
+        cost = self.cost(from_coord, to_coord)
+        if cost is False:
             return False
 
         # Collision check a little off the ground
@@ -110,17 +355,46 @@ class TerrainTraverser:
         if self.queue.get_num_entries():  # If 1 or more, abort.
             return False
 
-        # Yup, we can traverse, but at what cost?
-        cost = dxy
-        if dz > 0:  # Falling is considered free, climbing costs extra.
-            cost = cost * (1 + dz / dxy)  # LERP factor between 1 and 2.
+        # Yup, we can traverse, at the cost determined above.
         return cost
 
+    def are_traversible(self, coord_pairs):
+        # is_traversible for a list of (from_coord, to_coord), collision
+        # testing all of them in a single traversal.
+        results = [self.cost(from_coord, to_coord)
+                   for from_coord, to_coord in coord_pairs]
+        while len(self.batch_segments) < len(coord_pairs):
+            segment = CollisionSegment(0, 0, 0, 1, 0, 0)
+            segment_node = CollisionNode(f'segment {len(self.batch_segments)}')
+            segment_node.add_solid(segment)
+            segment_np = NodePath(segment_node)
+            segment_np.reparent_to(self.level)
+            self.batch_segments.append((segment, segment_np))
+
+        offset = Vec3(0, 0, 0.5)
+        self.batch_traverser.clear_colliders()
+        for idx, (from_coord, to_coord) in enumerate(coord_pairs):
+            if results[idx] is False:
+                continue
+            segment, segment_np = self.batch_segments[idx]
+            segment.set_point_a(from_coord + offset)
+            segment.set_point_b(to_coord + offset)
+            self.batch_traverser.add_collider(segment_np, self.batch_queue)
+        self.batch_traverser.traverse(self.level)
+
+        for entry in self.batch_queue.entries:
+            idx = int(entry.get_from_node().name.split()[1])
+            results[idx] = False
+        return results
+
     def remove(self):
         self.segment_np.remove_node()
+        for _, segment_np in self.batch_segments:
+            segment_np.remove_node()
+        self.batch_segments = []
 
 
-def determine_adjacenjy(level, navgrid):
+def determine_adjacenjy(level, navgrid, neighborhood=None):
     idx = 0
     coords = set()  # (x, y)
     by_coords = defaultdict(list)  # (x, y): [(idx, pos), ...]
@@ -133,8 +407,11 @@ def determine_adjacenjy(level, navgrid):
     progress = 0
     for x, y in coords:
         for from_idx, from_pos in by_coords[(x, y)]:
-            for dx, dy in neighbor_coords:
-                nx, ny = x + dx, y + dy
+            if neighborhood is None:
+                neighbors = [(x + dx, y + dy) for dx, dy in neighbor_coords]
+            else:
+                neighbors = neighborhood.get((x, y), ())
+            for nx, ny in neighbors:
                 if (nx, ny) in by_coords:
                     for to_idx, to_pos in by_coords[(nx, ny)]:
                         cost = tt.is_traversible(from_pos, to_pos)
@@ -150,22 +427,223 @@ def determine_adjacenjy(level, navgrid):
     return adj_dict
 
 
-def scan_level(level, stepsize=0.5):
+class LazyAdjacency:
+    """Stands in for the adjacency that determine_adjacenjy returns, but
+    only tests a node's edges when they are first asked for, and memoizes
+    them. Use fill() or fill_task() to evaluate the rest in the background.
+
+    Edges are stored like in a packed navgrid (see tacticsgrid.shared), in
+    flat arrays of targets and costs, in which each node's edges are a
+    chunk from starts[idx] to ends[idx]. Edges that are replaced go into the
+    node's chunk if they fit, or a new one otherwise; Once most of the
+    arrays are left over chunks, they are compacted. Looking up a node
+    returns a new dict, so edges are changed by assigning the node's whole
+    dict.
+
+    Anything that needs all edges, like iterating over it, asking for its
+    length, Navgrid.predecessors, FlowField, Landmarks and jump point
+    tables, raises a RuntimeError until it is complete, so that the time
+    to the first path isn't lost to an unnoticed evaluation of everything.
+    """
+    def __init__(self, level, navgrid, neighborhood=None):
+        self.navgrid = navgrid
+        self.neighborhood = neighborhood
+        self.by_coords = defaultdict(list)  # (x, y): [(idx, pos), ...]
+        for idx, (x, y, pos) in enumerate(navgrid):
+            self.by_coords[(x, y)].append((idx, pos))
+        self.starts = array('q', [-1]) * len(navgrid)  # -1: unevaluated
+        self.ends = array('q', [0]) * len(navgrid)
+        self.targets = array('l')
+        self.costs = array('d')
+        self.num_dead = 0  # Entries in targets / costs not in any chunk
+        self.num_evaluated = 0
+        self.unevaluated = iter(range(len(navgrid)))
+        self.complete = not navgrid
+        self.tt = TerrainTraverser(level)
+
+    def _edges(self, from_idx):
+        start, end = self.starts[from_idx], self.ends[from_idx]
+        return dict(zip(self.targets[start:end], self.costs[start:end]))
+
+    def _store(self, from_idx, edges):
+        start, end = self.starts[from_idx], self.ends[from_idx]
+        if start < 0:
+            self.num_evaluated += 1
+        elif len(edges) <= end - start:
+            self.targets[start:start + len(edges)] = array('l', edges.keys())
+            self.costs[start:start + len(edges)] = array('d', edges.values())
+            self.ends[from_idx] = start + len(edges)
+            self.num_dead += end - start - len(edges)
+            return
+        else:
+            self.num_dead += end - start
+        self.starts[from_idx] = len(self.targets)
+        self.targets.extend(edges.keys())
+        self.costs.extend(edges.values())
+        self.ends[from_idx] = len(self.targets)
+        if self.num_dead > len(self.targets) // 2:
+            self._compact()
+        if not self.complete and self.num_evaluated == len(self.navgrid):
+            self.complete = True
+            self.tt.remove()
+
+    def _compact(self):
+        targets = array('l')
+        costs = array('d')
+        for idx in range(len(self.navgrid)):
+            start, end = self.starts[idx], self.ends[idx]
+            if start < 0:
+                continue
+            self.starts[idx] = len(targets)
+            targets.extend(self.targets[start:end])
+            costs.extend(self.costs[start:end])
+            self.ends[idx] = len(targets)
+        self.targets = targets
+        self.costs = costs
+        self.num_dead = 0
+
+    def evaluate(self, from_idx):
+        if self.starts[from_idx] >= 0:
+            return self._edges(from_idx)
+        x, y, from_pos = self.navgrid[from_idx]
+        if self.neighborhood is None:
+            neighbors = [(x + dx, y + dy) for dx, dy in neighbor_coords]
+        else:
+            neighbors = self.neighborhood.get((x, y), ())
+        edges = {}
+        for nx, ny in neighbors:
+            for to_idx, to_pos in self.by_coords.get((nx, ny), ()):
+                cost = self.tt.is_traversible(from_pos, to_pos)
+                if cost:
+                    edges[to_idx] = cost
+        self._store(from_idx, edges)
+        return edges
+
+    def fill(self, max_nodes=None):
+        # Evaluates up to max_nodes more nodes (all, if None). Returns whether
+        # all edges are evaluated now.
+        evaluated = 0
+        for idx in self.unevaluated:
+            if self.complete:
+                break
+            if self.starts[idx] < 0:
+                self.evaluate(idx)
+                evaluated += 1
+                if max_nodes is not None and evaluated >= max_nodes:
+                    break
+        return self.complete
+
+    def fill_task(self, task, nodes_per_frame=100):
+        # base.task_mgr.add(lazy_adjacency.fill_task, 'fill adjacency')
+        if self.fill(nodes_per_frame):
+            return task.done
+        return task.cont
+
+    def get(self, from_idx, default=None):
+        if not 0 <= from_idx < len(self.navgrid):
+            return default
+        return self.evaluate(from_idx)
+
+    def __getitem__(self, from_idx):
+        if not 0 <= from_idx < len(self.navgrid):
+            raise KeyError(from_idx)
+        return self.evaluate(from_idx)
+
+    def __setitem__(self, from_idx, edges):
+        if not 0 <= from_idx < len(self.navgrid):
+            raise KeyError(from_idx)
+        self._store(from_idx, edges)
+
+    def __contains__(self, from_idx):
+        return bool(self.get(from_idx))
+
+    # Like the dict of determine_adjacenjy, only nodes with edges are keys.
+    def items(self):
+        if not self.complete:
+            raise RuntimeError("Not all edges are evaluated yet; fill() first")
+        return (
+            (idx, self._edges(idx)) for idx in range(len(self.navgrid))
+            if self.ends[idx] > self.starts[idx]
+        )
+
+    def keys(self):
+        return (idx for idx, _ in self.items())
+
+    def values(self):
+        return (edges for _, edges in self.items())
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return sum(1 for _ in self.items())
+
+    def remove(self):
+        if not self.complete:
+            self.tt.remove()
+
+
+def check_complete(grid):
+    # Raises unless all edges of the grid are known. A LazyAdjacency has to
+    # be filled first for anything that needs all of them, like
+    # predecessors, and so FlowField, Landmarks and jump point tables;
+    # Otherwise they would quietly evaluate every edge.
+    if not getattr(grid, 'complete', True):
+        raise RuntimeError("Not all edges are evaluated yet; fill() first")
+
+
+def scan_level(level, stepsize=0.5, adaptive_levels=0, timings=None,
+               lazy=False, merge_tolerance=0.01, stats=None):
+    # With adaptive_levels > 0, uniform areas of up to 2**adaptive_levels
+    # steps are represented by their corner nodes only. If lazy, a
+    # LazyAdjacency is returned instead of testing all edges now. Footfalls
+    # less than merge_tolerance apart vertically are merged. If timings is a
+    # dict, the duration of each phase is stored in it, if stats is, the
+    # numbers of rays, hits, merged hits, and nodes.
+    if timings is None:
+        timings = {}
+    if stats is None:
+        stats = {}
     bottom, top = level.get_tight_bounds()
     origin = Vec3(0, 0, top.z + 10)
     x_interval = (bottom.x, top.x, stepsize)
     y_interval = (bottom.y, top.y, stepsize)
     print("  Finding footfalls")
-    navgrid = find_footfalls(
-        level,
-        origin,
-        x_interval,
-        y_interval,
-    )
+    start = perf_counter()
+    if adaptive_levels:
+        navgrid, neighborhood = find_footfalls_adaptive(
+            level,
+            origin,
+            x_interval,
+            y_interval,
+            max_level=adaptive_levels,
+            merge_tolerance=merge_tolerance,
+            stats=stats,
+        )
+    else:
+        navgrid = find_footfalls(
+            level,
+            origin,
+            x_interval,
+            y_interval,
+            merge_tolerance=merge_tolerance,
+            stats=stats,
+        )
+        neighborhood = None
+    timings['footfalls'] = perf_counter() - start
+    print(f"  Merged {stats['merged_hits']} of {stats['hits']} hits")
     print("  Filtering for standability")
+    start = perf_counter()
     navgrid = filter_for_standability(level, navgrid)
-    print("  Determining adjacency")
-    adjacency = determine_adjacenjy(level, navgrid)
+    stats['nodes'] = len(navgrid)
+    timings['standability'] = perf_counter() - start
+    start = perf_counter()
+    if lazy:
+        adjacency = LazyAdjacency(level, navgrid, neighborhood)
+    else:
+        print("  Determining adjacency")
+        adjacency = determine_adjacenjy(level, navgrid, neighborhood)
+    timings['adjacency'] = perf_counter() - start
     return navgrid, adjacency
 
 
@@ -184,22 +662,227 @@ def to_wezu(navgrid, adjacency):
     # }
     wezu = dict(lookup={})
     for idx, (x_idx, y_idx, coord) in enumerate(navgrid):
-        wezu[str(idx)] = [coord, [], {}]
+        neighbors = [
+            [to_idx, cost]
+            for to_idx, cost in adjacency.get(idx, {}).items()
+        ]
+        wezu[str(idx)] = [coord, neighbors, {}]
+        wezu['lookup'][(coord.x, coord.y, coord.z)] = idx
+    return wezu
+
+
+def write_wezu(navgrid, adjacency, f):
+    # Writes to_wezu's format as JSON to the text file f, node by node, with
+    # coords as [x, y, z]. JSON keys have to be strings, so those of
+    # 'lookup' are written as "(x, y, z)".
+    f.write('{')
+    for idx, (_, _, coord) in enumerate(navgrid):
+        neighbors = ', '.join(
+            f'[{to_idx}, {float(cost)!r}]'
+            for to_idx, cost in adjacency.get(idx, {}).items()
+        )
+        f.write(f'"{idx}": [[{coord.x!r}, {coord.y!r}, {coord.z!r}], '
+                f'[{neighbors}], {{}}], ')
+    f.write('"lookup": {')
+    for idx, (_, _, coord) in enumerate(navgrid):
+        separator = ', ' if idx else ''
+        f.write(f'{separator}"({coord.x!r}, {coord.y!r}, {coord.z!r})": {idx}')
+    f.write('}}')
+
+
+# The binary variant of the wezu format: header, then float32 x, y, z per
+# node, uint32 offsets of each node's first neighbor plus the end, and the
+# neighbors as uint32 indices and float32 costs; All little-endian, whatever
+# the byte order of the machine.
+wezu_header = struct.Struct('<4sIII')  # magic, version, num nodes, num edges
+
+
+def _pack_le(typecode, values):
+    values = list(values)
+    return struct.pack(f'<{len(values)}{typecode}', *values)
+
+
+def _read_le(f, typecode, count):
+    layout = struct.Struct(f'<{count}{typecode}')
+    return layout.unpack(f.read(layout.size))
+
+
+def write_wezu_binary(navgrid, adjacency, f):
+    num_edges = sum(len(edges) for edges in adjacency.values())
+    f.write(wezu_header.pack(b'WZNG', 1, len(navgrid), num_edges))
+    f.write(_pack_le('f', (c for _, _, coord in navgrid for c in coord)))
+    offsets = [0]
+    for idx in range(len(navgrid)):
+        offsets.append(offsets[-1] + len(adjacency.get(idx, ())))
+    f.write(_pack_le('I', offsets))
+    for name, typecode in (('keys', 'I'), ('values', 'f')):
+        for idx in range(len(navgrid)):
+            edges = adjacency.get(idx)
+            if edges:
+                f.write(_pack_le(typecode, getattr(edges, name)()))
+
+
+def read_wezu_binary(f):
+    # Returns the navgrid in to_wezu's format.
+    magic, version, num_nodes, num_edges = wezu_header.unpack(
+        f.read(wezu_header.size),
+    )
+    if magic != b'WZNG' or version != 1:
+        raise ValueError("Not a binary wezu navgrid")
+    coords = _read_le(f, 'f', num_nodes * 3)
+    offsets = _read_le(f, 'I', num_nodes + 1)
+    targets = _read_le(f, 'I', num_edges)
+    costs = _read_le(f, 'f', num_edges)
+
+    wezu = dict(lookup={})
+    for idx in range(num_nodes):
+        coord = Vec3(*coords[idx * 3:idx * 3 + 3])
+        start, end = offsets[idx], offsets[idx + 1]
+        neighbors = [
+            [to_idx, cost]
+            for to_idx, cost in zip(targets[start:end], costs[start:end])
+        ]
+        wezu[str(idx)] = [coord, neighbors, {}]
         wezu['lookup'][(coord.x, coord.y, coord.z)] = idx
-    for from_idx, to_idx, cost in adjacency:
-        wezu[str(from_idx)][1].append([to_idx, cost])
     return wezu
 
 
+def strongly_connected_components(num_nodes, adjacency):
+    # Iterative Tarjan. Returns (component per node, number of components).
+    # Components are numbered in reverse topological order, so edges between
+    # components always go from a higher to a lower number.
+    index = [None] * num_nodes
+    low = [0] * num_nodes
+    on_stack = [False] * num_nodes
+    component = [None] * num_nodes
+    stack = []
+    counter = 0
+    num_components = 0
+    for root in range(num_nodes):
+        if index[root] is not None:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, iter(adjacency.get(root, ())))]
+        while work:
+            node, successors = work[-1]
+            for succ in successors:
+                if index[succ] is None:
+                    index[succ] = low[succ] = counter
+                    counter += 1
+                    stack.append(succ)
+                    on_stack[succ] = True
+                    work.append((succ, iter(adjacency.get(succ, ()))))
+                    break
+                elif on_stack[succ]:
+                    low[node] = min(low[node], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component[member] = num_components
+                        if member == node:
+                            break
+                    num_components += 1
+    return component, num_components
+
+
 class Navgrid:
     def __init__(self, navgrid, adjacency):
-        pass
+        self.navgrid = navgrid
+        self.adjacency = adjacency
+        self.reverse_adjacency = None
+        # Until a LazyAdjacency is complete, reachability isn't known.
+        self.reach = None
+        if self.complete:
+            self.update_components()
+
+    @property
+    def complete(self):
+        return getattr(self.adjacency, 'complete', True)
 
     def neighbors(self, from_idx):
-        return {idx: cost}
+        return self.adjacency.get(from_idx, {})
+
+    def predecessors(self, to_idx):
+        # {from_idx: cost} of the edges leading into to_idx. Needs all edges.
+        if self.reverse_adjacency is None:
+            reverse_adjacency = {}
+            for from_idx, edges in self.adjacency.items():
+                for idx, cost in edges.items():
+                    reverse_adjacency.setdefault(idx, {})[from_idx] = cost
+            self.reverse_adjacency = reverse_adjacency
+        return self.reverse_adjacency.get(to_idx, {})
 
     def nearest(self, coord):
-        return idx
+        return nearest_node(self.navgrid, coord)
+
+    def update_components(self):
+        # Since falling is one-way, reachability is determined on strongly
+        # connected components; reach[c] is a bitmask of the components that
+        # can be reached from component c.
+        self.component, num_components = strongly_connected_components(
+            len(self.navgrid),
+            self.adjacency,
+        )
+        successors = [set() for _ in range(num_components)]
+        for from_idx, edges in self.adjacency.items():
+            from_comp = self.component[from_idx]
+            for to_idx in edges:
+                if self.component[to_idx] != from_comp:
+                    successors[from_comp].add(self.component[to_idx])
+        self.reach = []
+        for comp in range(num_components):
+            reach = 1 << comp
+            for succ in successors[comp]:
+                reach |= self.reach[succ]
+            self.reach.append(reach)
+
+    def reachable(self, from_idx, to_idx):
+        if self.reach is None:
+            if not self.complete:
+                return True
+            self.update_components()
+        return bool(
+            self.reach[self.component[from_idx]] >> self.component[to_idx] & 1
+        )
+
+    # Edges are changed by replacing a node's dict, as a LazyAdjacency
+    # doesn't keep the dicts that it returns.
+    def set_edge(self, from_idx, to_idx, cost):
+        edges = dict(self.adjacency.get(from_idx, {}))
+        edges[to_idx] = cost
+        self.adjacency[from_idx] = edges
+        if self.reverse_adjacency is not None:
+            self.reverse_adjacency.setdefault(to_idx, {})[from_idx] = cost
+        if self.reach is None or self.reachable(from_idx, to_idx):
+            return
+        from_comp = self.component[from_idx]
+        to_comp = self.component[to_idx]
+        if self.reach[to_comp] >> from_comp & 1:
+            # The edge closes a cycle, so components merge.
+            self.reach = None
+            return
+        to_reach = self.reach[to_comp]
+        for comp, reach in enumerate(self.reach):
+            if reach >> from_comp & 1:
+                self.reach[comp] = reach | to_reach
+
+    def remove_edge(self, from_idx, to_idx):
+        edges = dict(self.adjacency[from_idx])
+        del edges[to_idx]
+        self.adjacency[from_idx] = edges
+        if self.reverse_adjacency is not None:
+            del self.reverse_adjacency[to_idx][from_idx]
+        # Components may split; Recalculated on the next query.
+        self.reach = None
 
 
 class DebugVisualization:
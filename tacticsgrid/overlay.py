@@ -0,0 +1,106 @@
+from heapq import heappush
+from heapq import heappop
+
+
+class Overlay:
+    """Turn-by-turn changes on top of a Navgrid, like occupied tiles, burning
+    ground, or temporary barricades, without touching its adjacency.
+
+    Blocked nodes can't be entered (but can be left, so a unit can path away
+    from the tile it stands on). The cost of an edge is multiplied by the
+    multiplier of the node it enters, and that of the edge itself. version
+    is increased with every change, so that users can tell whether what they
+    derived from the overlay is still current; Functions in listeners are
+    called as listener(nodes, cheaper) after each change. If cheaper is
+    False, only paths through nodes got more expensive; Otherwise something
+    was unblocked or got cheaper, which can improve on any path.
+
+    Since the overlay only ever removes edges, the Navgrid's reachable()
+    remains a valid check to reject queries with. Multipliers below 1 make
+    heuristics based on the baked costs, like Landmarks, inadmissible.
+    """
+    def __init__(self, grid):
+        self.grid = grid
+        self.blocked = bytearray(len(grid.navgrid))
+        self.num_blocked = 0
+        self.node_costs = {}  # idx: multiplier
+        self.edge_costs = {}  # (from_idx, to_idx): multiplier
+        self.version = 0
+        self.listeners = []
+
+    def _changed(self, nodes, cheaper):
+        self.version += 1
+        for listener in self.listeners:
+            listener(nodes, cheaper)
+
+    def block(self, idx):
+        if not self.blocked[idx]:
+            self.blocked[idx] = 1
+            self.num_blocked += 1
+            self._changed([idx], False)
+
+    def unblock(self, idx):
+        if self.blocked[idx]:
+            self.blocked[idx] = 0
+            self.num_blocked -= 1
+            self._changed([idx], True)
+
+    def set_node_cost(self, idx, multiplier):
+        cheaper = multiplier < self.node_costs.get(idx, 1.0)
+        if multiplier == 1.0:
+            self.node_costs.pop(idx, None)
+        else:
+            self.node_costs[idx] = multiplier
+        self._changed([idx], cheaper)
+
+    def set_edge_cost(self, from_idx, to_idx, multiplier):
+        edge = (from_idx, to_idx)
+        cheaper = multiplier < self.edge_costs.get(edge, 1.0)
+        if multiplier == 1.0:
+            self.edge_costs.pop(edge, None)
+        else:
+            self.edge_costs[edge] = multiplier
+        self._changed([to_idx], cheaper)
+
+    def clear(self):
+        self.blocked = bytearray(len(self.grid.navgrid))
+        self.num_blocked = 0
+        self.node_costs.clear()
+        self.edge_costs.clear()
+        self._changed([], True)
+
+    def neighbors(self, from_idx):
+        edges = self.grid.neighbors(from_idx)
+        if not (self.num_blocked or self.node_costs or self.edge_costs):
+            return edges
+        blocked = self.blocked
+        node_costs = self.node_costs
+        edge_costs = self.edge_costs
+        neighbors = {}
+        for to_idx, cost in edges.items():
+            if blocked[to_idx]:
+                continue
+            if to_idx in node_costs:
+                cost *= node_costs[to_idx]
+            if edge_costs and (from_idx, to_idx) in edge_costs:
+                cost *= edge_costs[(from_idx, to_idx)]
+            neighbors[to_idx] = cost
+        return neighbors
+
+    def movement_range(self, from_idx, budget):
+        # {idx: cost} of all nodes reachable from from_idx at no more than
+        # budget cost.
+        costs = {from_idx: 0.0}
+        queue = [(0.0, from_idx)]
+        while queue:
+            cost, node = heappop(queue)
+            if cost > costs[node]:
+                continue  # Stale entry
+            for to_idx, step_cost in self.neighbors(node).items():
+                to_cost = cost + step_cost
+                if to_cost > budget:
+                    continue
+                if to_cost < costs.get(to_idx, float('inf')):
+                    costs[to_idx] = to_cost
+                    heappush(queue, (to_cost, to_idx))
+        return costs
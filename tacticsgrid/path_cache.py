@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from collections import defaultdict
+
+
+class PathCache:
+    """Caches paths found by find_path(from_idx, to_idx) -> (cost, path),
+    where grid is the Navgrid that the paths run over.
+
+    Since any suffix of an optimal path is also optimal, a cached path from
+    A to B also answers queries from any node on it to B. The cache holds at
+    most capacity paths, evicting the least recently used one.
+
+    When a part of the navgrid changes, the paths running through it have to
+    be dropped with invalidate_nodes or invalidate_region. If traversal has
+    become cheaper somewhere, paths elsewhere may be suboptimal now as well,
+    and the cache should be cleared instead. If find_path searches an
+    Overlay, pass it as overlay, so that step costs are taken from it, and
+    the cache does either on each of its changes.
+    """
+    def __init__(self, grid, find_path, capacity=256, overlay=None):
+        self.grid = grid
+        self.find_path = find_path
+        self.overlay = overlay
+        if overlay is not None:
+            overlay.listeners.append(self.overlay_changed)
+        self.capacity = capacity
+        self.entries = OrderedDict()  # (from, to): (remaining_costs, path)
+        self.through = defaultdict(set)  # node: {(from, to), ...}
+        self.suffixes = defaultdict(dict)  # to: {node: (from, to)}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, from_idx, to_idx):
+        key = self.suffixes.get(to_idx, {}).get(from_idx)
+        if key is None:
+            return None
+        self.entries.move_to_end(key)
+        remaining_costs, path = self.entries[key]
+        pos = path.index(from_idx)
+        return remaining_costs[pos], path[pos:]
+
+    def path(self, from_idx, to_idx):
+        cached = self.lookup(from_idx, to_idx)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        cost, path = self.find_path(from_idx, to_idx)
+        self.add(cost, path)
+        return cost, path
+
+    def add(self, cost, path):
+        key = (path[0], path[-1])
+        if key in self.entries:
+            self._remove(key)
+        edges = self.grid if self.overlay is None else self.overlay
+        remaining_costs = [cost]
+        for from_idx, to_idx in zip(path, path[1:]):
+            step_cost = edges.neighbors(from_idx)[to_idx]
+            remaining_costs.append(remaining_costs[-1] - step_cost)
+        self.entries[key] = (remaining_costs, path)
+        for node in path:
+            self.through[node].add(key)
+            self.suffixes[key[1]][node] = key
+        while len(self.entries) > self.capacity:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        _, path = self.entries.pop(key)
+        suffixes = self.suffixes[key[1]]
+        for node in path:
+            self.through[node].discard(key)
+            if not self.through[node]:
+                del self.through[node]
+            if suffixes.get(node) == key:
+                del suffixes[node]
+        if not suffixes:
+            del self.suffixes[key[1]]
+
+    def invalidate_nodes(self, nodes):
+        keys = set()
+        for node in nodes:
+            keys.update(self.through.get(node, ()))
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def invalidate_region(self, bottom, top):
+        # Drops all paths running through a node within the box.
+        navgrid = self.grid.navgrid
+        nodes = [
+            node for node in self.through
+            if bottom.x <= navgrid[node][2].x <= top.x
+            and bottom.y <= navgrid[node][2].y <= top.y
+            and bottom.z <= navgrid[node][2].z <= top.z
+        ]
+        return self.invalidate_nodes(nodes)
+
+    def overlay_changed(self, nodes, cheaper):
+        if cheaper:
+            self.clear()
+        else:
+            self.invalidate_nodes(nodes)
+
+    def clear(self):
+        self.entries.clear()
+        self.through.clear()
+        self.suffixes.clear()
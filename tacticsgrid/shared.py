@@ -0,0 +1,294 @@
+import mmap
+import struct
+import sys
+from array import array
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from panda3d.core import Vec3
+
+from tacticsgrid.navgrid import Navgrid
+from tacticsgrid.navgrid import check_complete
+
+
+# A baked navgrid as flat arrays, so that it can be put into shared memory
+# or a file, and be used by several processes without copying it. After the
+# header follow, each aligned to 8 bytes:
+#   coords     int32   [x, y] per node
+#   positions  float64 [x, y, z] per node
+#   offsets    int64   node's first edge in targets / costs, plus the end
+#   targets    int32   per edge
+#   costs      float64 per edge
+# and the same three for the reversed edges, then Navgrid's reachability:
+#   component  int32   per node
+#   reach      uint8   per component, a bit per component, little end first
+# If flags has HAS_JUMP_TABLES, the tables of
+# tacticsgrid.jump_point.jump_point_tables follow:
+#   jump_uniform  uint8   per node
+#   jump_kept     uint8   8 per node
+#   jump_steps    int32   8 per node
+#   jump_costs    float64 8 per node
+MAGIC = b'TGNG'
+FORMAT_VERSION = 3
+HAS_JUMP_TABLES = 1
+# magic, version, flags, num nodes, num edges, num components
+header = struct.Struct('<4sIIQQQ')
+
+
+def _reach_row(num_components):
+    # Bytes per component in the reach section
+    return (num_components + 7) // 8
+
+
+def _layout(num_nodes, num_edges, num_components=0, flags=0):
+    num_jump = num_nodes if flags & HAS_JUMP_TABLES else 0
+    sections = [
+        ('coords', 'i', num_nodes * 2),
+        ('positions', 'd', num_nodes * 3),
+        ('offsets', 'q', num_nodes + 1),
+        ('targets', 'i', num_edges),
+        ('costs', 'd', num_edges),
+        ('reverse_offsets', 'q', num_nodes + 1),
+        ('reverse_targets', 'i', num_edges),
+        ('reverse_costs', 'd', num_edges),
+        ('component', 'i', num_nodes),
+        ('reach', 'B', num_components * _reach_row(num_components)),
+        ('jump_uniform', 'B', num_jump),
+        ('jump_kept', 'B', num_jump * 8),
+        ('jump_steps', 'i', num_jump * 8),
+        ('jump_costs', 'd', num_jump * 8),
+    ]
+    layout = []
+    offset = header.size + (-header.size % 8)
+    for name, typecode, count in sections:
+        layout.append((name, typecode, offset, count))
+        offset += count * array(typecode).itemsize
+        offset += -offset % 8
+    return layout, offset
+
+
+def _flatten(navgrid, adjacency, jump_tables=None):
+    # Returns the arrays of all sections, and the header.
+    grid = Navgrid(navgrid, adjacency)
+    check_complete(grid)
+    num_nodes = len(navgrid)
+    forward = [adjacency.get(idx, {}) for idx in range(num_nodes)]
+    backward = [{} for _ in range(num_nodes)]
+    for from_idx, edges in enumerate(forward):
+        for to_idx, cost in edges.items():
+            backward[to_idx][from_idx] = cost
+
+    arrays = dict(
+        jump_uniform=array('B'),
+        jump_kept=array('B'),
+        jump_steps=array('i'),
+        jump_costs=array('d'),
+        coords=array('i', (c for x, y, _ in navgrid for c in (x, y))),
+        positions=array('d', (c for _, _, pos in navgrid for c in pos)),
+    )
+    for prefix, edge_lists in (('', forward), ('reverse_', backward)):
+        offsets = array('q', [0])
+        targets = array('i')
+        costs = array('d')
+        for edges in edge_lists:
+            targets.extend(edges.keys())
+            costs.extend(edges.values())
+            offsets.append(len(targets))
+        arrays[prefix + 'offsets'] = offsets
+        arrays[prefix + 'targets'] = targets
+        arrays[prefix + 'costs'] = costs
+
+    num_components = len(grid.reach)
+    row = _reach_row(num_components)
+    arrays['component'] = array('i', grid.component)
+    arrays['reach'] = array('B', b''.join(
+        reach.to_bytes(row, 'little') for reach in grid.reach
+    ))
+
+    flags = 0
+    if jump_tables is not None:
+        flags |= HAS_JUMP_TABLES
+        uniform, kept, steps, step_costs = jump_tables
+        arrays['jump_uniform'] = array('B', uniform)
+        arrays['jump_kept'] = array('B', kept)
+        arrays['jump_steps'] = array('i', steps)
+        arrays['jump_costs'] = array('d', step_costs)
+    return arrays, (num_nodes, len(arrays['targets']), num_components, flags)
+
+
+def _write(buf, arrays, sizes):
+    num_nodes, num_edges, num_components, flags = sizes
+    layout, size = _layout(num_nodes, num_edges, num_components, flags)
+    buf = memoryview(buf)
+    buf[:header.size] = header.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        flags,
+        num_nodes,
+        num_edges,
+        num_components,
+    )
+    for name, typecode, offset, count in layout:
+        data = arrays[name].tobytes()
+        buf[offset:offset + len(data)] = data
+    return size
+
+
+def packed_size(navgrid, adjacency, jump_tables=None):
+    _, sizes = _flatten(navgrid, adjacency, jump_tables)
+    num_nodes, num_edges, num_components, flags = sizes
+    return _layout(num_nodes, num_edges, num_components, flags)[1]
+
+
+def pack_navgrid(navgrid, adjacency, buf, jump_tables=None):
+    # Writes the navgrid into buf, which must be at least packed_size long.
+    return _write(buf, *_flatten(navgrid, adjacency, jump_tables))
+
+
+def save_navgrid(navgrid, adjacency, filename, jump_tables=None):
+    arrays, sizes = _flatten(navgrid, adjacency, jump_tables)
+    buf = bytearray(_layout(*sizes)[1])
+    _write(buf, arrays, sizes)
+    with open(filename, 'wb') as f:
+        f.write(buf)
+
+
+class _NodeView:
+    # Looks like the navgrid list of (x, y, pos), but reads from the arrays.
+    def __init__(self, coords, positions):
+        self.coords = coords
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.coords) // 2
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        pos = self.positions[idx * 3:idx * 3 + 3]
+        return self.coords[idx * 2], self.coords[idx * 2 + 1], Vec3(*pos)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class SharedNavgrid:
+    """Read-only navgrid on a packed buffer, with the query interface of
+    Navgrid, so that it can be used with PathCache, FlowField, Landmarks,
+    Overlay and JumpPointSearch, which uses the jump_tables baked with it.
+    reachable() reads the components baked with it, so workers don't have
+    to determine them again.
+
+    The publishing process uses publish() to put a navgrid into shared
+    memory, or save_navgrid() to write it to a file; Workers use attach()
+    or load() respectively. Neither copies the navgrid. Only the publisher
+    unlinks the shared memory; Attaching doesn't register it with the
+    worker's resource tracker, which would unlink it when the worker exits.
+    """
+    def __init__(self, buf, owner=None):
+        self.owner = owner  # Keeps the SharedMemory / mmap alive
+        self.buf = memoryview(buf).toreadonly()
+        (magic, version, flags, num_nodes, num_edges,
+         num_components) = header.unpack_from(self.buf)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not a packed navgrid of a supported version")
+        self.reach_row = _reach_row(num_components)
+        layout, _ = _layout(num_nodes, num_edges, num_components, flags)
+        for name, typecode, offset, count in layout:
+            itemsize = array(typecode).itemsize
+            section = self.buf[offset:offset + count * itemsize]
+            setattr(self, name, section.cast(typecode))
+        self.navgrid = _NodeView(self.coords, self.positions)
+        if flags & HAS_JUMP_TABLES:
+            self.jump_tables = (
+                self.jump_uniform,
+                self.jump_kept,
+                self.jump_steps,
+                self.jump_costs,
+            )
+        else:
+            self.jump_tables = None
+
+    @classmethod
+    def publish(cls, navgrid, adjacency, name=None, jump_tables=None):
+        arrays, sizes = _flatten(navgrid, adjacency, jump_tables)
+        shm = SharedMemory(
+            name=name,
+            create=True,
+            size=_layout(*sizes)[1],
+        )
+        _write(shm.buf, arrays, sizes)
+        return cls(shm.buf, owner=shm)
+
+    @classmethod
+    def attach(cls, name):
+        if sys.version_info >= (3, 13):
+            shm = SharedMemory(name=name, track=False)
+        else:
+            # Unregistering afterwards would also drop the publisher's
+            # registration if both share a tracker, as pool workers do, so
+            # it is kept from registering in the first place.
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                shm = SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+        return cls(shm.buf, owner=shm)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapped, owner=mapped)
+
+    @property
+    def name(self):
+        return self.owner.name
+
+    def _edges(self, offsets, targets, costs, idx):
+        start, end = offsets[idx], offsets[idx + 1]
+        return dict(zip(targets[start:end], costs[start:end]))
+
+    def neighbors(self, from_idx):
+        return self._edges(self.offsets, self.targets, self.costs, from_idx)
+
+    def predecessors(self, to_idx):
+        return self._edges(
+            self.reverse_offsets,
+            self.reverse_targets,
+            self.reverse_costs,
+            to_idx,
+        )
+
+    def reachable(self, from_idx, to_idx):
+        to_comp = self.component[to_idx]
+        byte = self.reach[self.component[from_idx] * self.reach_row
+                          + to_comp // 8]
+        return bool(byte >> to_comp % 8 & 1)
+
+    def nearest(self, coord):
+        positions = self.positions
+        best_idx = None
+        best_dist = float('inf')
+        for idx in range(len(self.navgrid)):
+            dx = positions[idx * 3] - coord.x
+            dy = positions[idx * 3 + 1] - coord.y
+            dz = positions[idx * 3 + 2] - coord.z
+            dist = dx * dx + dy * dy + dz * dz
+            if dist < best_dist:
+                best_idx, best_dist = idx, dist
+        return best_idx
+
+    def close(self):
+        # All views into the buffer have to be released before it can be.
+        for name, _, _, _ in _layout(0, 0)[0]:
+            getattr(self, name).release()
+        self.buf.release()
+        self.owner.close()
+
+    def unlink(self):
+        # Frees the shared memory once every process has closed it; Only to
+        # be called by the publisher.
+        self.owner.unlink()
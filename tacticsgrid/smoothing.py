@@ -0,0 +1,155 @@
+from collections import defaultdict
+
+from tacticsgrid.navgrid import TerrainTraverser
+
+
+def supercover(from_x, from_y, to_x, to_y):
+    # The columns, as squares around the lattice points, that the line
+    # between two lattice points touches, in order. Where it passes exactly
+    # through a corner, both columns beside it are included.
+    dx, dy = to_x - from_x, to_y - from_y
+    num_x, num_y = abs(dx), abs(dy)
+    step_x, step_y = (dx > 0) - (dx < 0), (dy > 0) - (dy < 0)
+    x, y = from_x, from_y
+    columns = [(x, y)]
+    done_x = done_y = 0
+    while done_x < num_x or done_y < num_y:
+        decision = (1 + 2 * done_x) * num_y - (1 + 2 * done_y) * num_x
+        if decision == 0:
+            columns += [(x + step_x, y), (x, y + step_y)]
+            x += step_x
+            y += step_y
+            done_x += 1
+            done_y += 1
+        elif decision < 0:
+            x += step_x
+            done_x += 1
+        else:
+            y += step_y
+            done_y += 1
+        columns.append((x, y))
+    return columns
+
+
+class PathSmoother:
+    """Removes redundant waypoints from paths found on a navgrid, by walking
+    straight from each waypoint to the farthest later one that can be
+    reached directly.
+
+    A shortcut has to pass TerrainTraverser's rules for walking and climbing,
+    and there have to be nodes in every column it touches, at the heights of
+    the straight line between its ends, so that it neither crosses gaps nor
+    walks over or through obstacles that the path went around. Navgrids from
+    find_footfalls_adaptive have no nodes inside their cells, so shortcuts
+    can't cross those; Paths there run along the cells' sides and diagonals
+    already.
+
+    If the path was found on an Overlay, pass it as overlay. Then those nodes
+    also mustn't be blocked, and neither they nor the edges between them may
+    have multipliers, since shortcuts are costed by TerrainTraverser; The
+    steps of the path that are kept cost what the overlay says. Shortcuts
+    are collision tested batch_size at a time.
+    """
+    def __init__(self, level, navgrid, batch_size=8, height_tolerance=0.1,
+                 overlay=None):
+        self.navgrid = navgrid
+        self.batch_size = batch_size
+        self.height_tolerance = height_tolerance
+        self.overlay = overlay
+        self.terrain_traverser = TerrainTraverser(level)
+        self.columns = defaultdict(list)  # (x, y): [(z, idx), ...]
+        for idx, (x, y, pos) in enumerate(navgrid):
+            self.columns[(x, y)].append((pos.z, idx))
+
+    def _avoided(self, idx):
+        overlay = self.overlay
+        return overlay is not None and (
+            overlay.blocked[idx] or idx in overlay.node_costs
+        )
+
+    def _crosses_costed_edge(self, nodes):
+        # Whether the overlay has a multiplier for an edge between nodes.
+        if self.overlay is None:
+            return False
+        return any(
+            from_idx in nodes and to_idx in nodes
+            for from_idx, to_idx in self.overlay.edge_costs
+        )
+
+    def has_footing(self, from_idx, to_idx):
+        from_x, from_y, from_pos = self.navgrid[from_idx]
+        to_x, to_y, to_pos = self.navgrid[to_idx]
+        dx, dy = to_x - from_x, to_y - from_y
+        dz = to_pos.z - from_pos.z
+        length_squared = dx * dx + dy * dy
+        nodes = {from_idx, to_idx}
+        for column in supercover(from_x, from_y, to_x, to_y)[1:-1]:
+            # Height of the line where it passes closest to the column
+            t = ((column[0] - from_x) * dx
+                 + (column[1] - from_y) * dy) / length_squared
+            z = from_pos.z + dz * min(max(t, 0.0), 1.0)
+            footing = [
+                idx for height, idx in self.columns.get(column, ())
+                if abs(height - z) <= self.height_tolerance
+            ]
+            if not footing or any(self._avoided(idx) for idx in footing):
+                return False
+            nodes.update(footing)
+        return not self._crosses_costed_edge(nodes)
+
+    def _farthest_shortcut(self, indices, anchor):
+        # Index of the farthest waypoint reachable from the one at anchor,
+        # and the cost of getting there, or None.
+        best = None
+        start = anchor + 2
+        while start < len(indices):
+            end = min(start + self.batch_size, len(indices))
+            candidates = [
+                target for target in range(start, end)
+                if self.has_footing(indices[anchor], indices[target])
+            ]
+            from_pos = self.navgrid[indices[anchor]][2]
+            costs = self.terrain_traverser.are_traversible([
+                (from_pos, self.navgrid[indices[target]][2])
+                for target in candidates
+            ])
+            reachable = [
+                (target, cost) for target, cost in zip(candidates, costs)
+                if cost is not False
+            ]
+            if reachable:
+                best = reachable[-1]
+            # Further shortcuts are only looked for if the whole batch worked.
+            if not reachable or best[0] != end - 1:
+                break
+            start = end
+        return best
+
+    def smooth(self, path):
+        # Takes and returns (cost, [idx, ...]), as returned by a search.
+        _, indices = path
+        waypoints = [indices[0]]
+        cost = 0.0
+        anchor = 0
+        while anchor < len(indices) - 1:
+            shortcut = self._farthest_shortcut(indices, anchor)
+            if shortcut is None:
+                target = anchor + 1
+                if self.overlay is not None:
+                    step_cost = self.overlay.neighbors(
+                        indices[anchor],
+                    )[indices[target]]
+                else:
+                    step_cost = self.terrain_traverser.cost(
+                        self.navgrid[indices[anchor]][2],
+                        self.navgrid[indices[target]][2],
+                    )
+            else:
+                target, step_cost = shortcut
+            waypoints.append(indices[target])
+            cost += step_cost
+            anchor = target
+        return cost, waypoints
+
+    def remove(self):
+        self.terrain_traverser.remove()